@@ -1,276 +1,635 @@
-import argparse
-import csv
-import gzip
-import json
-import os
-import shutil
-import string
-from pathlib import Path
-from random import sample
-from time import perf_counter
-from typing import TypeVar
-
-import jsonlines
-import urllib3
-import urllib3.exceptions
-import xmltodict
-
-_Path = TypeVar("_Path", str, Path)
-
-
-def fast_line_count(file: _Path, has_header: bool = False) -> int:
-    """Counts the number of newlines in a file using an 8MB buffer
-
-    file: file to count lines of
-    header: whether the file has a header (to not count)
-    """
-
-    line_count = 0
-
-    with open(file, "rb") as file_buffer:
-        while 1:
-            buffer = file_buffer.read(8192 * 1024)
-            if not buffer:
-                break
-            line_count += buffer.count(b"\n")
-    if has_header:
-        line_count -= 1
-    return line_count
-
-
-def upw_request(doi: str, email: str = "unpaywall_01@example.com") -> dict:
-    """Performs a request via the UPW REST API
-
-    doi: digital identifier of the paper
-    email: address required for API requests
-    """
-    url: str = f"https://api.unpaywall.org/v2/{doi}?email={email}"
-    http = urllib3.PoolManager()
-    response = http.request("GET", url)
-
-    json_data: dict = json.loads(response.data)
-
-    if "error" in json_data:
-        return {}
-    return json_data
-
-
-def pmc_request(pmc_id: str) -> dict:
-    """Performs a request via the OA API
-
-    pmcid: PubMedCentral ID
-    """
-
-    url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id={pmc_id}&format=pdf"
-    retry = True
-    http = urllib3.PoolManager()
-    data_dict = {}
-
-    while retry:
-        try:
-            response = http.request("GET", url)
-            data_dict = xmltodict.parse(response.data)
-            retry = False
-        except urllib3.exceptions.MaxRetryError:
-            pass
-    return data_dict
-
-
-def unified_processor(
-    csv_path,
-    sample_size: int = 850,
-    email: str = "unpaywall_01@example.com",
-):
-    """Produces UPW and PMC format files for BGH
-
-    csv_path: path to PubMed format csv files.
-    email: email address for UPW calls
-    sample_size: sampling size
-    """
-
-    file_name = str(os.path.basename(csv_path)).removesuffix(".csv")
-
-    # removes year from filename if present
-    field = file_name.translate(str.maketrans("", "", string.digits))
-
-    if not os.path.exists(Path(f"./output/{field}")):
-        os.makedirs(Path(f"./output/{field}"))
-
-    if not os.path.exists(Path(f"./reports/{field}")):
-        os.makedirs(Path(f"./reports/{field}"))
-
-    jsonl_file = Path(f"./output/{field}/{file_name}-UPW.jsonl")
-    txt_file = Path(f"./output/{field}/{file_name}-PMC.txt")
-    dump_path = Path(f"./reports/{field}/{file_name}-dump.csv")
-
-    line_count = fast_line_count(csv_path, True)
-
-    print(f"{line_count} entries.")
-
-    # creates a sorted list of line numbers to avoid storing entire csv files to memory
-    sample_size = sample_size if sample_size < line_count else (line_count - 1)
-    selection: list[int] = sample(range(1, line_count + 2), sample_size)
-    selection.sort()
-
-    print(f"Processing {sample_size} samples of {csv_path}")
-    start_time = perf_counter()
-
-    with open(csv_path, "r", encoding="utf-8") as csv_file, jsonlines.open(
-        jsonl_file, mode="w"
-    ) as jsonl_writer, open(dump_path, "w", encoding="utf-8") as dump_file, open(
-        txt_file, "w", encoding="ascii"
-    ) as txt_writer:
-        # Creates a dummy line for biblio-glutton-harvester
-        txt_writer.write("DatePlaceholder\n")
-
-        # initialize counts
-        count: dict[str, int] = {
-            "upw": 0,
-            "pmc": 0,
-            "discard": 0,
-            "no_pdf": 0,
-            "total": 0,
-        }
-
-        position = 0
-        sample_position = 0
-
-        dump_writer = csv.writer(dump_file, dialect="unix")
-
-        for row in csv.reader(csv_file):
-            if sample_position == sample_size:
-                break
-            # skips header
-            if position == 0:
-                position += 1
-                continue
-            # if sampling, skips non samples
-            if selection is not None and position != selection[sample_position]:
-                position += 1
-                continue
-            count["total"] += 1
-
-            # sets up fields for unpaywall and PMC API
-            pmc_id = row[8]
-            pubmed_id = row[0]
-            doi = row[10]
-
-            print(f"Processing entry {count['total']}", end="\r")
-
-            if bool(doi):
-                json_data = upw_request(doi, email)
-                if bool(json_data):
-                    jsonl_writer.write(json_data)
-
-                    count["upw"] += 1
-
-                    sample_position += 1
-                    position += 1
-                    continue
-
-            # discards PMC ids that didn't return pmids
-            if pubmed_id == "":
-                count["discard"] += 1
-
-                sample_position += 1
-                position += 1
-                continue
-            data_dict = pmc_request(pmc_id)
-
-            path = None
-            if "error" not in data_dict["OA"]:
-                path = data_dict["OA"]["records"]["record"]["link"]["@href"]
-            # discards papers with no pdf available
-            if path is None:
-                count["no_pdf"] += 1
-                dump_list = [doi, pmc_id]
-                dump_writer.writerow(dump_list)
-
-                position += 1
-                sample_position += 1
-                continue
-            # remove ftp prefix from filepath
-            subpath: str = path.removeprefix("ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/")
-
-            # line formatting for entry into output txt file
-            output_line = (
-                f"{subpath}\t"
-                "CitationPlaceholder\t"
-                f"{pmc_id}\t"
-                f"PMID:{pubmed_id}\t"
-                "LicensePlaceholder\n"
-            )
-
-            txt_writer.write(output_line)
-            count["pmc"] += 1
-
-            sample_position += 1
-            position += 1
-        print("Finished writing to output files.")
-        end_time = perf_counter()
-
-        print(
-            f"""{count['total']} entries processed in 
-
-            {(end_time - start_time):.2f} seconds."""
-        )
-
-        print(f"{count['upw']} entries saved to {jsonl_file}")
-        print(f"{count['pmc']} entries saved to {txt_file}")
-        print(f"{count['discard']} entries discarded due to missing information")
-        print(f"{count['no_pdf']} entries discarded due to unavailable pdf downloads")
-    # compresses jsonl to jsonl.gz
-    with open(jsonl_file, "rb") as to_compress:
-        jsonlgz_file = f"{jsonl_file}.gz"
-        with gzip.open(jsonlgz_file, "wb") as compress_file:
-            shutil.copyfileobj(to_compress, compress_file)
-    print(f"{os.path.basename(jsonl_file)} compressed to .gz")
-
-    # deletes jsonl file
-    os.remove(jsonl_file)
-
-    # removes txt file if empty
-    if count["pmc"] == 0:
-        os.remove(txt_file)
-    # removes dump file if empty
-    if count["no_pdf"] == 0:
-        os.remove(dump_path)
-
-    return count.values()
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Processes PubMed CSV files for biblio-glutton harvesting"
-    )
-
-    parser.add_argument("field", type=str)
-    parser.add_argument(
-        "--start", dest="startyear", type=int, default=2012, required=False
-    )
-    parser.add_argument("--end", dest="endyear", type=int, default=2022, required=False)
-    parser.add_argument("-s", "--samples", dest="samples", type=int, default=850)
-    parser.add_argument(
-        "-e", "--email", dest="email", type=str, default="unpaywall_01@example.com"
-    )
-    args = parser.parse_args()
-
-    if not os.path.exists(Path(f"./reports/{args.field}")):
-        os.makedirs(Path(f"./reports/{args.field}"))
-
-    report_path = Path(f"./reports/{args.field}/{args.field}Report.csv")
-
-    with open(report_path, mode="w", encoding="utf-8") as report_file:
-        csv_writer = csv.writer(report_file, dialect="unix")
-        header = ["Year", "UPW", "PMC", "NoPubMed", "NoPDF", "Total"]
-        csv_writer.writerow(header)
-        for y in range(args.startyear, args.endyear + 1, 1):
-            print_list = [y]
-
-            return_list = unified_processor(
-                Path(f"./input/{args.field}/{args.field}{y}.csv"),
-                sample_size=args.samples,
-                email=args.email,
-            )
-            print_list.extend(return_list)
-            csv_writer.writerow(print_list)
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import mmap
+import os
+import sqlite3
+import string
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from random import sample
+from time import perf_counter, time
+from typing import TypeVar
+
+import aiohttp
+import orjson
+import pandas as pd
+from aiohttp_retry import ExponentialRetry, RetryClient
+from lxml import etree
+
+__all__ = [
+    "build_snapshot_db",
+    "fast_line_count",
+    "pmc_request",
+    "unified_processor",
+    "upw_request",
+]
+
+_Path = TypeVar("_Path", str, Path)
+
+_CACHE_PATH = Path(".upw_pmc_cache.sqlite")
+_CACHE_MAX_AGE = 30 * 24 * 60 * 60  # seconds
+# statuses whose bodies are safe to reuse, including negative results;
+# transient failures (429, 5xx) must not be cached
+_CACHE_CODES = (200, 402, 403, 404)
+
+_PMC_FTP_PREFIX = "ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/"
+_OUTPUT_LINE = "{}\tCitationPlaceholder\t{}\tPMID:{}\tLicensePlaceholder\n".format
+
+
+class _CacheConnection(sqlite3.Connection):
+    """sqlite connection carrying an in-memory batch of pending cache rows"""
+
+    pending: list[tuple[str, bytes, float]]
+
+
+def _cache_connect() -> _CacheConnection:
+    """Opens the on-disk response cache, creating the table if needed"""
+    connection = sqlite3.connect(_CACHE_PATH, timeout=30, factory=_CacheConnection)
+    connection.pending = []
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS responses"
+        " (url TEXT PRIMARY KEY, body BLOB, fetched REAL)"
+    )
+    connection.commit()
+    return connection
+
+
+def _cache_get(cache: _CacheConnection, url: str) -> bytes | None:
+    """Returns the cached response body for url, or None if absent or stale"""
+    row = cache.execute(
+        "SELECT body FROM responses WHERE url = ? AND fetched > ?",
+        (url, time() - _CACHE_MAX_AGE),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _cache_flush(cache: _CacheConnection) -> None:
+    """Writes the pending rows in one short transaction
+
+    Kept synchronous and brief so the database write lock is never held
+    across awaited network I/O.
+    """
+    if not cache.pending:
+        return
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", cache.pending
+        )
+    cache.pending.clear()
+
+
+def _cache_put(cache: _CacheConnection, url: str, body: bytes) -> None:
+    """Stores a response body for url
+
+    Rows accumulate in memory and are flushed every 64th put; the caller
+    must call _cache_flush once more before closing.
+    """
+    cache.pending.append((url, body, time()))
+    if len(cache.pending) >= 64:
+        _cache_flush(cache)
+
+
+def build_snapshot_db(snapshot_file: _Path, db_path: _Path = "snap.sqlite") -> None:
+    """Loads an Unpaywall data-feed snapshot (jsonl.gz) into a sqlite lookup table
+
+    Build once per downloaded snapshot; runs passed the resulting database via
+    --snapshot resolve DOIs locally and only fall back to the REST API on
+    misses.
+
+    snapshot_file: path to the downloaded snapshot (jsonl.gz)
+    db_path: path of the sqlite database to build
+    """
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS upw (doi TEXT PRIMARY KEY, json TEXT)"
+    )
+
+    batch: list[tuple[str, str]] = []
+    with gzip.open(snapshot_file, "rt", encoding="utf-8") as snapshot:
+        for line in snapshot:
+            record = orjson.loads(line)
+            doi = record.get("doi")
+            # skips malformed snapshot lines rather than aborting the build
+            if not doi:
+                continue
+            # lowercased to match lookups; PubMed DOIs are often mixed-case
+            batch.append((doi.lower(), line.rstrip("\n")))
+            # commits in batches of 10 000 inside one transaction
+            if len(batch) == 10_000:
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO upw VALUES (?, ?)", batch
+                    )
+                batch.clear()
+    if batch:
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO upw VALUES (?, ?)", batch)
+    connection.close()
+
+
+def _snapshot_get(snapshot: sqlite3.Connection, doi: str) -> dict | None:
+    """Returns the snapshot record for doi, or None if not present
+
+    The lookup is lowercased to match the keys written by build_snapshot_db.
+    """
+    row = snapshot.execute(
+        "SELECT json FROM upw WHERE doi = ?", (doi.lower(),)
+    ).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+
+async def cached_request(
+    session: RetryClient, cache: _CacheConnection, url: str
+) -> bytes:
+    """Returns the response body for url, hitting the network only on a miss
+
+    Negative results (402/403/404) are cached too, so known-missing ids are
+    not re-queried on warm runs; anything outside _CACHE_CODES passes through
+    uncached.
+
+    session: shared client session for API requests
+    cache: on-disk response cache
+    url: request url
+    """
+    body = _cache_get(cache, url)
+    if body is None:
+        async with session.get(url) as response:
+            body = await response.read()
+            status = response.status
+        if status in _CACHE_CODES:
+            _cache_put(cache, url, body)
+    return body
+
+
+def fast_line_count(file: _Path, has_header: bool = False) -> int:
+    """Counts the number of newlines in a file with a single mmap scan
+
+    file: file to count lines of
+    header: whether the file has a header (to not count)
+    """
+
+    if os.path.getsize(file) == 0:
+        return 0
+
+    chunk_size = 64 * 1024 * 1024
+
+    with open(file, "rb") as file_buffer:
+        with mmap.mmap(file_buffer.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # hints the kernel to read ahead where supported
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            # mmap has no count(), so scan the map in large slices
+            line_count = sum(
+                mapped[offset : offset + chunk_size].count(b"\n")
+                for offset in range(0, len(mapped), chunk_size)
+            )
+    if has_header:
+        line_count -= 1
+    return line_count
+
+
+async def upw_request(
+    session: RetryClient,
+    cache: _CacheConnection,
+    doi: str,
+    email: str = "unpaywall_01@example.com",
+    snapshot: sqlite3.Connection | None = None,
+) -> dict:
+    """Performs a request via the UPW REST API
+
+    session: shared client session for API requests
+    cache: on-disk response cache
+    doi: digital identifier of the paper
+    email: address required for API requests
+    snapshot: local Unpaywall snapshot database, tried before the API
+    """
+    if snapshot is not None:
+        json_data = _snapshot_get(snapshot, doi)
+        if json_data is not None:
+            return {} if "error" in json_data else json_data
+
+    url: str = f"https://api.unpaywall.org/v2/{doi}?email={email}"
+    json_data: dict = orjson.loads(await cached_request(session, cache, url))
+
+    if "error" in json_data:
+        return {}
+    return json_data
+
+
+async def pmc_request(
+    session: RetryClient, cache: _CacheConnection, pmc_id: str
+) -> str | None:
+    """Requests the pdf download link for a paper via the OA API
+
+    Returns None if the API reports an error or no link is available.
+
+    session: shared client session for API requests
+    cache: on-disk response cache
+    pmcid: PubMedCentral ID
+    """
+
+    url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id={pmc_id}&format=pdf"
+    root = etree.fromstring(await cached_request(session, cache, url))
+    hrefs = root.xpath("/OA/records/record/link/@href")
+    return hrefs[0] if hrefs else None
+
+
+async def _bounded(semaphore: asyncio.Semaphore, coroutine):
+    """Awaits coroutine while holding a slot in semaphore"""
+    async with semaphore:
+        return await coroutine
+
+
+async def process_row(
+    session: RetryClient,
+    cache: _CacheConnection,
+    row: tuple,
+    upw_by_doi: dict,
+    pmc_links: dict,
+) -> tuple:
+    """Resolves a row against the prefetched UPW records, falling back to the OA API
+
+    session: shared client session for API requests
+    cache: on-disk response cache
+    row: (pmid, pmcid, doi) fields of a csv row in PubMed format
+    upw_by_doi: prefetched UPW records keyed by DOI
+    pmc_links: shared per-run memo of OA links keyed by PMC id
+    """
+    pubmed_id, pmc_id, doi = row
+
+    if bool(doi):
+        json_data = upw_by_doi.get(doi, {})
+        if bool(json_data):
+            return ("upw", json_data)
+
+    # discards PMC ids that didn't return pmids
+    if pubmed_id == "":
+        return ("discard", None)
+
+    # discards rows without a usable PMC id instead of firing a doomed request
+    pmc_id = pmc_id.upper()
+    if not pmc_id.startswith("PMC"):
+        return ("discard", None)
+
+    if pmc_id in pmc_links:
+        path = pmc_links[pmc_id]
+    else:
+        path = await pmc_request(session, cache, pmc_id)
+        pmc_links[pmc_id] = path
+
+    # discards papers with no pdf available
+    if path is None:
+        return ("no_pdf", [doi, pmc_id])
+    # remove ftp prefix from filepath
+    subpath: str = path.removeprefix(_PMC_FTP_PREFIX)
+
+    # line formatting for entry into output txt file
+    output_line = _OUTPUT_LINE(subpath, pmc_id, pubmed_id)
+    return ("pmc", output_line)
+
+
+async def produce_rows(rows: list, sample_q: asyncio.Queue, fetchers: int) -> None:
+    """Streams sampled rows into sample_q, then tells each fetcher to stop
+
+    rows: sampled csv rows in PubMed format
+    sample_q: bounded queue feeding the fetcher stage
+    fetchers: number of fetcher coroutines to shut down afterwards
+    """
+    for row in rows:
+        await sample_q.put(row)
+    for _ in range(fetchers):
+        await sample_q.put(None)
+
+
+async def fetch_rows(
+    session: RetryClient,
+    cache: _CacheConnection,
+    sample_q: asyncio.Queue,
+    result_q: asyncio.Queue,
+    upw_by_doi: dict,
+    pmc_links: dict,
+) -> None:
+    """Resolves rows from sample_q and pushes the outcomes onto result_q
+
+    Stops when it pulls the None sentinel left by produce_rows.
+
+    session: shared client session for API requests
+    cache: on-disk response cache
+    sample_q: bounded queue of sampled rows
+    result_q: bounded queue of (outcome, payload) results
+    upw_by_doi: prefetched UPW records keyed by DOI
+    pmc_links: shared per-run memo of OA links keyed by PMC id
+    """
+    while True:
+        row = await sample_q.get()
+        if row is None:
+            break
+        await result_q.put(await process_row(session, cache, row, upw_by_doi, pmc_links))
+
+
+async def write_results(
+    result_q: asyncio.Queue,
+    jsonl_stream,
+    txt_writer,
+    dump_writer,
+    count: dict,
+) -> None:
+    """Drains outcomes from result_q into the output files
+
+    Stops when it pulls the None sentinel queued after the fetchers finish.
+
+    result_q: bounded queue of (outcome, payload) results
+    jsonl_stream: binary stream for the UPW jsonl output
+    txt_writer: writer for the PMC txt output
+    dump_writer: csv writer for discarded entries
+    count: result counts, updated in place
+    """
+    # batches the small text writes so they hit the file 256 rows at a time
+    pmc_lines: list[str] = []
+    dump_rows: list[list[str]] = []
+
+    while True:
+        result = await result_q.get()
+        if result is None:
+            break
+        outcome, payload = result
+        count["total"] += 1
+        # rate-limits the progress line to every 32nd entry
+        if count["total"] & 31 == 0:
+            sys.stdout.write(f"\rProcessing entry {count['total']}")
+            sys.stdout.flush()
+
+        if outcome == "upw":
+            jsonl_stream.write(orjson.dumps(payload) + b"\n")
+            count["upw"] += 1
+        elif outcome == "pmc":
+            pmc_lines.append(payload)
+            if len(pmc_lines) >= 256:
+                txt_writer.writelines(pmc_lines)
+                pmc_lines.clear()
+            count["pmc"] += 1
+        elif outcome == "no_pdf":
+            dump_rows.append(payload)
+            if len(dump_rows) >= 256:
+                dump_writer.writerows(dump_rows)
+                dump_rows.clear()
+            count["no_pdf"] += 1
+        else:
+            count["discard"] += 1
+
+    # flushes whatever is left in the batches
+    txt_writer.writelines(pmc_lines)
+    dump_writer.writerows(dump_rows)
+
+
+async def process_sample(
+    rows: list,
+    email: str,
+    jsonl_stream,
+    txt_writer,
+    dump_writer,
+    count: dict,
+    snapshot_db: _Path | None = None,
+) -> None:
+    """Concurrently fetches all sampled rows and streams results to the writers
+
+    rows: sampled csv rows in PubMed format
+    email: address required for UPW requests
+    jsonl_stream: binary stream for the UPW jsonl output
+    txt_writer: writer for the PMC txt output
+    dump_writer: csv writer for discarded entries
+    count: result counts, updated in place
+    snapshot_db: optional local Unpaywall snapshot database
+    """
+    retry_options = ExponentialRetry(attempts=3)
+    # pools and reuses connections to the two API hosts across the whole run
+    connector = aiohttp.TCPConnector(limit=32, limit_per_host=16)
+    cache = _cache_connect()
+    snapshot = sqlite3.connect(snapshot_db) if snapshot_db is not None else None
+    try:
+        async with RetryClient(
+            connector=connector, retry_options=retry_options
+        ) as session:
+            semaphore = asyncio.Semaphore(20)
+
+            # fetches each unique DOI exactly once; rows then share the results
+            unique_dois = sorted({row[2] for row in rows if row[2]})
+            upw_results = await asyncio.gather(
+                *(
+                    _bounded(
+                        semaphore, upw_request(session, cache, doi, email, snapshot)
+                    )
+                    for doi in unique_dois
+                )
+            )
+            upw_by_doi = dict(zip(unique_dois, upw_results))
+            pmc_links: dict[str, str | None] = {}
+
+            # three bounded stages: sampler -> fetcher pool -> writer, so network
+            # wait, parsing, and compressed writes overlap with backpressure
+            sample_q: asyncio.Queue = asyncio.Queue(maxsize=64)
+            result_q: asyncio.Queue = asyncio.Queue(maxsize=64)
+
+            fetchers = [
+                asyncio.create_task(
+                    fetch_rows(
+                        session, cache, sample_q, result_q, upw_by_doi, pmc_links
+                    )
+                )
+                for _ in range(20)
+            ]
+            writer = asyncio.create_task(
+                write_results(result_q, jsonl_stream, txt_writer, dump_writer, count)
+            )
+
+            await produce_rows(rows, sample_q, len(fetchers))
+            await asyncio.gather(*fetchers)
+            await result_q.put(None)
+            await writer
+    finally:
+        if snapshot is not None:
+            snapshot.close()
+        # persists whatever is left of the in-memory batch
+        _cache_flush(cache)
+        cache.close()
+
+
+def unified_processor(
+    csv_path,
+    sample_size: int = 850,
+    email: str = "unpaywall_01@example.com",
+    snapshot_db: _Path | None = None,
+):
+    """Produces UPW and PMC format files for BGH
+
+    csv_path: path to PubMed format csv files.
+    email: email address for UPW calls
+    sample_size: sampling size
+    snapshot_db: optional local Unpaywall snapshot database (see
+        build_snapshot_db), used instead of the REST API where possible
+    """
+
+    file_name = str(os.path.basename(csv_path)).removesuffix(".csv")
+
+    # removes year from filename if present
+    field = file_name.translate(str.maketrans("", "", string.digits))
+
+    output_dir = Path(f"./output/{field}")
+    report_dir = Path(f"./reports/{field}")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    jsonlgz_file = output_dir / f"{file_name}-UPW.jsonl.gz"
+    txt_file = output_dir / f"{file_name}-PMC.txt"
+    dump_path = report_dir / f"{file_name}-dump.csv"
+
+    start_time = perf_counter()
+
+    # samples line numbers up front so pandas only materializes the selected
+    # rows, keeping memory at O(sample_size) rather than the whole file
+    line_count = fast_line_count(csv_path, True)
+    sample_size = min(sample_size, line_count)
+    # data rows are 1-indexed for skiprows since row 0 is the header
+    selection = set(sample(range(1, line_count + 1), sample_size))
+
+    # parses only the three used columns of the selected rows with the C engine
+    with open(csv_path, "rb", buffering=1 << 20) as csv_file:
+        frame = pd.read_csv(
+            csv_file,
+            usecols=[0, 8, 10],
+            header=0,
+            dtype=str,
+            keep_default_na=False,
+            engine="c",
+            skiprows=lambda index: index > 0 and index not in selection,
+        )
+
+    sampled_rows = list(frame.itertuples(index=False, name=None))
+
+    print(f"Processing {len(sampled_rows)} samples of {csv_path}")
+
+    # compresses the jsonl output on the fly instead of re-reading it afterwards;
+    # the buffered writers coalesce the small per-record writes on both sides of
+    # the gzip stream
+    with open(jsonlgz_file, "wb", buffering=0) as raw_file, io.BufferedWriter(
+        raw_file, buffer_size=1 << 20
+    ) as buffered_file, gzip.GzipFile(
+        fileobj=buffered_file, mode="wb", compresslevel=6
+    ) as gz_file, io.BufferedWriter(
+        gz_file, buffer_size=256 * 1024
+    ) as gz_buffer, open(
+        dump_path, "w", encoding="utf-8", buffering=1 << 20, newline=""
+    ) as dump_file, open(
+        txt_file, "w", encoding="ascii", buffering=1 << 20
+    ) as txt_writer:
+        # Creates a dummy line for biblio-glutton-harvester
+        txt_writer.write("DatePlaceholder\n")
+
+        # initialize counts
+        count: dict[str, int] = {
+            "upw": 0,
+            "pmc": 0,
+            "discard": 0,
+            "no_pdf": 0,
+            "total": 0,
+        }
+
+        dump_writer = csv.writer(dump_file, dialect="unix")
+
+        asyncio.run(
+            process_sample(
+                sampled_rows,
+                email,
+                gz_buffer,
+                txt_writer,
+                dump_writer,
+                count,
+                snapshot_db,
+            )
+        )
+        print("Finished writing to output files.")
+        end_time = perf_counter()
+
+        print(
+            f"""{count['total']} entries processed in 
+
+            {(end_time - start_time):.2f} seconds."""
+        )
+
+        print(f"{count['upw']} entries saved to {jsonlgz_file}")
+        print(f"{count['pmc']} entries saved to {txt_file}")
+        print(f"{count['discard']} entries discarded due to missing information")
+        print(f"{count['no_pdf']} entries discarded due to unavailable pdf downloads")
+    # removes jsonl.gz file if empty
+    if count["upw"] == 0:
+        os.remove(jsonlgz_file)
+    # removes txt file if empty
+    if count["pmc"] == 0:
+        os.remove(txt_file)
+    # removes dump file if empty
+    if count["no_pdf"] == 0:
+        os.remove(dump_path)
+
+    return list(count.values())
+
+
+def main() -> None:
+    """Command-line entry point; processes one field across a range of years"""
+    parser = argparse.ArgumentParser(
+        description="Processes PubMed CSV files for biblio-glutton harvesting"
+    )
+
+    parser.add_argument("field", type=str)
+    parser.add_argument(
+        "--start", dest="startyear", type=int, default=2012, required=False
+    )
+    parser.add_argument("--end", dest="endyear", type=int, default=2022, required=False)
+    parser.add_argument("-s", "--samples", dest="samples", type=int, default=850)
+    parser.add_argument(
+        "-e", "--email", dest="email", type=str, default="unpaywall_01@example.com"
+    )
+    parser.add_argument(
+        "--snapshot",
+        dest="snapshot",
+        type=str,
+        default=None,
+        help="sqlite database built from an Unpaywall snapshot (see build_snapshot_db)",
+    )
+    args = parser.parse_args()
+
+    Path(f"./reports/{args.field}").mkdir(parents=True, exist_ok=True)
+
+    report_path = Path(f"./reports/{args.field}/{args.field}Report.csv")
+
+    years = list(range(args.startyear, args.endyear + 1))
+    csv_paths = [Path(f"./input/{args.field}/{args.field}{y}.csv") for y in years]
+
+    with open(report_path, mode="w", encoding="utf-8") as report_file:
+        csv_writer = csv.writer(report_file, dialect="unix")
+        header = ["Year", "UPW", "PMC", "NoPubMed", "NoPDF", "Total"]
+        csv_writer.writerow(header)
+
+        # each year reads and writes its own files, so the years run in parallel
+        worker = partial(
+            unified_processor,
+            sample_size=args.samples,
+            email=args.email,
+            snapshot_db=args.snapshot,
+        )
+        # cpu_count() can return None, and an empty year range must not
+        # request a zero-worker pool
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(len(years), os.cpu_count() or 1))
+        ) as executor:
+            for year, return_list in zip(years, executor.map(worker, csv_paths)):
+                csv_writer.writerow([year, *return_list])
+
+
+if __name__ == "__main__":
+    main()